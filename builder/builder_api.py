@@ -1,11 +1,14 @@
 import os
 import json
+import warnings
 import pprint
 from bigraph_schema.registry import get_path, set_path, deep_merge
 from bigraph_schema import Edge
 from bigraph_schema.protocols import local_lookup_module
 from process_bigraph import Process, Step, Composite, ProcessTypes
 from bigraph_viz.diagram import plot_bigraph
+from builder.dict_utils import intern_references, expand_references
+from builder.selector import SelectorIndex, wire_targets
 
 
 pretty = pprint.PrettyPrinter(indent=2)
@@ -102,8 +105,12 @@ class BuilderNode:
             # set the value
             set_path(tree=self.builder.tree, path=path_here, value=value)
 
+        if len(tail) == 0:
+            self.builder.mark_edited([path_here])
+
     def update(self, state):
         self.builder.tree = deep_merge(self.builder.tree, state)
+        self.builder.mark_edited([(key,) for key in state])
         self.builder.complete()
 
     def value(self):
@@ -145,6 +152,12 @@ class BuilderNode:
         }
 
         set_path(tree=self.builder.tree, path=self.path, value=state)
+
+        # completing may also add the stores this process is wired to
+        self.builder.mark_edited(
+            [self.path]
+            + wire_targets(self.path[:-1], state['inputs'])
+            + wire_targets(self.path[:-1], state['outputs']))
         self.builder.complete()
 
     def connect(self, port=None, target=None):
@@ -152,22 +165,28 @@ class BuilderNode:
         schema = self.schema()
         assert self.builder.core.check('edge', value), "connect only works on edges"
 
+        wires = {}
         if port in schema['_inputs']:
             value['inputs'][port] = target
+            wires[port] = target
         if port in schema['_outputs']:
             value['outputs'][port] = target
+            wires[port] = target
+        self.builder.mark_edited(wire_targets(self.path[:-1], wires))
 
     def connect_all(self, append_to_store_name='_store'):
         # Check if the current node is an edge and perform connections if it is
         value = self.value()
         if self.builder.core.check('edge', value):
             schema = self.schema()
+            wires = {}
             for port in schema.get('_inputs', {}).keys():
                 if port not in value.get('inputs', {}):
-                    value['inputs'][port] = [port + append_to_store_name]
+                    value['inputs'][port] = wires[port] = [port + append_to_store_name]
             for port in schema.get('_outputs', {}).keys():
                 if port not in value.get('outputs', {}):
-                    value['outputs'][port] = [port + append_to_store_name]
+                    value['outputs'][port] = wires[port] = [port + append_to_store_name]
+            self.builder.mark_edited(wire_targets(self.path[:-1], wires))
             # Optionally, update the current node value here if necessary
 
         # Recursively apply connect_all to all child nodes
@@ -178,8 +197,8 @@ class BuilderNode:
         value = self.value()
         schema = self.schema()
         if not self.builder.core.check('edge', value):
-            warnings.warn(f"Expected '_type' to be in {EDGE_KEYS}, found '{tree_type}' instead.")
-        elif self.builder.core.check('edge', value):
+            warnings.warn(f"Expected an edge at {self.path}, found {value!r} instead.")
+        else:
             process_ports = {}
             process_ports['_inputs'] = schema.get('_inputs', {})
             process_ports['_outputs'] = schema.get('_outputs', {})
@@ -204,12 +223,23 @@ class Builder:
         if file_path:
             with open(file_path, 'r') as file:
                 graph_data = json.load(file)
+                # documents written with references=True are expanded here
+                graph_data = expand_references(graph_data)
                 tree = deep_merge(tree, graph_data)
 
         self.core = core or ProcessTypes()
         self.schema, self.tree = self.core.complete(schema, tree)
         self.node = node_from_tree(self, self.schema, self.tree)
 
+        # the selector indexes are built on the first query, then only the
+        # paths edited since then are reindexed
+        self.selector = None
+
+    def mark_edited(self, paths):
+        """ Record edited paths for the selector to reindex on the next query """
+        if self.selector is not None:
+            self.selector.pending.update(paths)
+
     def __repr__(self):
         return f"Builder({pf(self.tree)})"
 
@@ -232,6 +262,30 @@ class Builder:
     def complete(self):
         self.schema, self.tree = self.core.complete(self.schema, self.tree)
 
+    def select(self, pattern=None, type=None, address=None, config=None):
+        """
+        Select nodes by glob path pattern, type, process address and config values.
+
+        `pattern` is a tuple of keys where '*' matches one level and '**' any
+        number of levels, for example ('*', 'cell', '**'). `type` is a type
+        expression such as 'map[float]', `address` a process address or
+        registered process name, and `config` a dict of config values that
+        a process must have. Returns a list of BuilderNodes.
+        """
+        if self.selector is None:
+            self.selector = SelectorIndex(self.core, self.schema, self.tree)
+        else:
+            self.selector.refresh(self.schema, self.tree)
+
+        paths = self.selector.select(
+            pattern=pattern,
+            type=type,
+            address=address,
+            config=config,
+            tree=self.tree)
+
+        return [self[path] for path in paths]
+
     def connect_all(self, append_to_store_name='_store'):
         self.node.connect_all(append_to_store_name=append_to_store_name)
 
@@ -253,17 +307,23 @@ class Builder:
 
         return composite
 
-    def document(self):
-        return self.core.serialize(
+    def document(self, references=False):
+        document = self.core.serialize(
             self.schema,
             self.tree)
 
-    def write(self, filename, outdir='out'):
+        if references:
+            # store repeated subtrees once in a reference table
+            document = intern_references(document)
+
+        return document
+
+    def write(self, filename, outdir='out', references=False):
         if not os.path.exists(outdir):
             os.makedirs(outdir)
 
         filepath = f"{outdir}/{filename}.json"
-        document = self.document()
+        document = self.document(references=references)
 
         # Writing the dictionary to a JSON file
         with open(filepath, 'w') as json_file:
@@ -274,6 +334,12 @@ class Builder:
     def register_type(self, key, schema):
         self.core.type_registry.register(key, schema)
 
+        # the registry memoizes string lookups, misses included, so a type
+        # looked up before it was registered would keep resolving to None
+        cache_clear = getattr(self.core.type_registry.access_str, 'cache_clear', None)
+        if cache_clear:
+            cache_clear()
+
     def register_process(self, process_name, address=None):
         """
         Register processes into the local core type system
@@ -406,5 +472,190 @@ def test_builder():
                       show_types=True)
 
 
+def gillespie_builder():
+    """ Builder over the DNA and mRNA stores with GillespieEvent registered """
+    from process_bigraph.experiments.minimal_gillespie import GillespieEvent, EXPORT
+
+    core = ProcessTypes()
+    core.import_types(EXPORT)
+
+    builder = Builder(
+        core=core,
+        tree={
+            'DNA_store': {
+                '_type': 'map[float]',
+                'A gene': 2.0,
+                'B gene': 1.0},
+            'mRNA_store': {
+                '_type': 'map[float]',
+                'A mRNA': 0.0,
+                'B mRNA': 0.0}})
+    builder.register_process('GillespieEvent', GillespieEvent)
+    return builder
+
+
+def test_write_references():
+    builder = gillespie_builder()
+    for index in range(100):
+        builder[f'event_{index}'].add_process(name='GillespieEvent', kdeg=1.0)
+    builder.connect_all(append_to_store_name='_store')
+
+    # replicated processes are stored once as a whole
+    expanded = builder.document()
+    interned = builder.document(references=True)
+    assert interned['event_0'] == interned['event_99'] == {'_ref': '0'}
+    assert len(json.dumps(expanded)) > 10 * len(json.dumps(interned))
+
+    builder.write(filename='builder_references_doc', references=True)
+
+    # round trip through the reference table is lossless
+    builder2 = Builder(core=builder.core, file_path='out/builder_references_doc.json')
+    assert builder2.document() == expanded
+
+
+def test_intern_nested_references():
+    from builder.dict_utils import intern_references, expand_references
+
+    # a composite whose config holds sub-processes with repeated configs
+    config = {'rate': 1.0, 'address': 'local:increase', 'interval': 1.0}
+    document = {
+        'comp': {
+            'config': {
+                'state': {
+                    'p': {'config': config},
+                    'q': {'config': dict(config)}}}},
+        'single': {'config': {'rate': 2.0}}}
+
+    interned = intern_references(document)
+    assert interned['comp']['config']['state']['p'] == {'_ref': '0'}
+    assert interned['single'] == document['single']
+    assert expand_references(interned) == document
+
+    # key and value types survive the round trip, and repeated objects are counted
+    shared = {'values': (1, 2), 'count': 3, 'label': 'shared fragment'}
+    int_keys = {1: 'value', 'values': [1, 2], 'label': 'typed fragment'}
+    str_keys = {'1': 'value', 'values': (1, 2), 'label': 'typed fragment'}
+    document = {
+        'a1': int_keys,
+        'a2': dict(int_keys),
+        'b1': str_keys,
+        'b2': dict(str_keys),
+        'c': shared,
+        'd': shared}
+    interned = intern_references(document)
+    assert interned['a1'] == interned['a2'] != interned['b1'] == interned['b2']
+    assert interned['c'] == interned['d']
+    expanded = expand_references(interned)
+    assert expanded == document
+    assert 1 in expanded['a2'] and '1' in expanded['b2']
+    assert isinstance(expanded['b2']['values'], tuple)
+    assert isinstance(expanded['d']['values'], tuple)
+
+    # reserved keys are refused rather than misread
+    for reserved in ({'x': {'_ref': '0'}}, {'_references': {}}):
+        try:
+            intern_references(reserved)
+            assert False, 'expected a ValueError'
+        except ValueError:
+            pass
+
+def test_select():
+    builder = gillespie_builder()
+    builder['down', 'here'] = {
+        '_value': 10,
+        '_type': 'integer'}
+    builder['event_0'].add_process(name='GillespieEvent', kdeg=1.0)
+    builder['event_1'].add_process(name='GillespieEvent', kdeg=2.0)
+
+    # edits are not recorded before the first query builds the indexes
+    assert builder.selector is None
+
+    # select by type
+    stores = builder.select(type='map[float]')
+    assert [node.path for node in stores] == [('DNA_store',), ('mRNA_store',)]
+    assert [node.path for node in builder.select(type='map[ float ]')] == [('DNA_store',), ('mRNA_store',)]
+    assert [node.path for node in builder.select(type='integer')] == [('down', 'here')]
+    assert builder.select(type='map[') == []
+
+    # map entries are indexed by their value type
+    assert [node.path for node in builder.select(('DNA_store', '*'), type='float')] == [
+        ('DNA_store', 'A gene'), ('DNA_store', 'B gene')]
+
+    # select by registered process name or full address
+    events = builder.select(address='GillespieEvent')
+    assert [node.path for node in events] == [('event_0',), ('event_1',)]
+    assert builder.select(address='local:GillespieEvent')[1].path == ('event_1',)
+
+    # select by config values
+    assert [node.path for node in builder.select(config={'kdeg': 2.0})] == [('event_1',)]
+    assert builder.select(config={'kdeg': 3.0}) == []
+
+    # select by glob path
+    assert [node.path for node in builder.select(('*_store', 'A *'))] == [
+        ('DNA_store', 'A gene'), ('mRNA_store', 'A mRNA')]
+    assert [node.path for node in builder.select(('**', 'here'))] == [('down', 'here')]
+    assert [node.path for node in builder.select(('event_1',))] == [('event_1',)]
+    assert builder.select(('event_9',)) == []
+
+    # edits only reindex the paths they touch
+    selector = builder.selector
+    builder['event_2'].add_process(name='GillespieEvent', kdeg=2.0)
+    builder['DNA_store', 'C gene'] = 3.0
+    builder['down', 'here'] = 5
+    assert [node.path for node in builder.select(address='GillespieEvent', config={'kdeg': 2.0})] == [
+        ('event_1',), ('event_2',)]
+    assert builder.selector is selector
+    assert ('DNA_store', 'C gene') in builder.selector.type_index['float']
+
+    # selected nodes can be edited in bulk
+    for node in builder.select(address='GillespieEvent'):
+        node.connect_all(append_to_store_name='_store')
+    assert builder['event_2'].value()['inputs']['DNA'] == ['DNA_store']
+
+    # wire targets are indexed once a later complete() creates their stores
+    builder['event_0'].connect(port='DNA', target=['new_store'])
+    builder['event_1'].connect(port='no_such_port', target=['ignored'])
+    assert builder.select(('new_store', '**')) == []
+    assert builder.selector.pending == {('new_store',)}
+
+    # string wires name a single store
+    assert wire_targets(('cell',), {'DNA': 'DNA_store'}) == [('cell', 'DNA_store')]
+    builder['other'] = 1.0
+    assert [node.path for node in builder.select(('new_store', '*'))] == [
+        ('new_store', 'A gene'), ('new_store', 'B gene')]
+    assert builder.selector.pending == set()
+
+    # the incrementally updated indexes match a fresh build
+    builder.select()
+    rebuilt = SelectorIndex(builder.core, builder.schema, builder.tree)
+    assert builder.selector.type_index == rebuilt.type_index
+    assert builder.selector.addresses == rebuilt.addresses
+    assert builder.selector.configs == rebuilt.configs
+    assert set(builder.selector.paths) == set(rebuilt.paths)
+
+    # a wire set before the first query still gets its store indexed later
+    builder = gillespie_builder()
+    builder['event_0'].add_process(name='GillespieEvent')
+    builder['event_0'].connect(port='DNA', target=['new_store'])
+    builder.select()
+    builder['other'] = 1.0
+    assert [node.path for node in builder.select(('new_store', '**'))] == [
+        ('new_store',), ('new_store', 'A gene'), ('new_store', 'B gene')]
+    rebuilt = SelectorIndex(builder.core, builder.schema, builder.tree)
+    assert set(builder.selector.paths) == set(rebuilt.paths)
+
+
+def test_register_type_after_lookup():
+    builder = Builder()
+
+    # a failed lookup does not stick once the type is registered
+    assert builder.core.access('concentration') is None
+    builder.register_type('concentration', {'_inherit': 'float'})
+    assert builder.core.access('concentration')['_type'] == 'concentration'
+
+
 if __name__ == '__main__':
     test_builder()
+    test_write_references()
+    test_select()
+    test_register_type_after_lookup()
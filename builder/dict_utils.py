@@ -1,3 +1,6 @@
+import copy
+import json
+
 
 def custom_pf(d, indent=0):
     """Custom dictionary formatter to achieve specific indentation styles."""
@@ -19,3 +22,110 @@ def custom_pf(d, indent=0):
         return f"{{\n{items_str}\n{' ' * (indent - 4)}}}"
     else:
         return f"{{\n{items_str}\n}}"
+
+
+REFERENCE_TABLE_KEY = '_references'
+REFERENCE_KEY = '_ref'
+
+# fragments shorter than this (in canonical form) are cheaper to repeat than to reference
+MIN_FRAGMENT_SIZE = 64
+
+
+def _scalar(value):
+    # keep the type, so that 1, 1.0, True and '1' stay distinct
+    return f'{type(value).__name__}:{value!r}'
+
+
+def _canonical(tree, keys, counts):
+    """Canonical form of a subtree, recording the form of every nested dict in
+    `keys` by id and counting every occurrence of it in `counts`."""
+    if isinstance(tree, dict):
+        if REFERENCE_KEY in tree and len(tree) == 1:
+            raise ValueError(f'cannot intern a document that already contains a reference: {tree}')
+
+        items = sorted(
+            (_scalar(key), _canonical(value, keys, counts))
+            for key, value in tree.items())
+        canonical = '{' + ','.join(f'{key}:{value}' for key, value in items) + '}'
+        keys[id(tree)] = canonical
+        counts[canonical] = counts.get(canonical, 0) + 1
+        return canonical
+
+    if isinstance(tree, (list, tuple)):
+        elements = ','.join(_canonical(element, keys, counts) for element in tree)
+        return f'{type(tree).__name__}[{elements}]'
+
+    return _scalar(tree)
+
+
+def _replace_fragments(tree, keys, counts, table, ids):
+    result = {}
+    for key, value in tree.items():
+        if isinstance(value, dict):
+            fragment_key = keys[id(value)]
+            if counts[fragment_key] > 1 and len(fragment_key) >= MIN_FRAGMENT_SIZE:
+                if fragment_key not in ids:
+                    ref_id = str(len(ids))
+                    ids[fragment_key] = ref_id
+                    table[ref_id] = value
+                result[key] = {REFERENCE_KEY: ids[fragment_key]}
+            else:
+                result[key] = _replace_fragments(value, keys, counts, table, ids)
+        else:
+            result[key] = value
+    return result
+
+
+def intern_references(document):
+    """Move repeated subtrees of a document into a shared reference table.
+
+    Every dict that appears more than once and is large enough to be worth it
+    is stored once under the top-level `_references` key, and each occurrence
+    is replaced by `{'_ref': <id>}`. The largest repeated subtree wins, so a
+    replicated process is stored once as a whole, while processes that differ
+    only in part still share their identical config, wires or port schemas.
+    Documents that already use the reserved `_references` key or hold a
+    `{'_ref': ...}` dict are refused with a ValueError.
+    """
+    if REFERENCE_TABLE_KEY in document:
+        raise ValueError(f'cannot intern a document with a top-level "{REFERENCE_TABLE_KEY}" key')
+
+    keys = {}
+    counts = {}
+    _canonical(document, keys, counts)
+
+    table = {}
+    interned = _replace_fragments(document, keys, counts, table, {})
+    if table:
+        interned[REFERENCE_TABLE_KEY] = table
+    return interned
+
+
+def _is_reference(value):
+    return isinstance(value, dict) and len(value) == 1 and REFERENCE_KEY in value
+
+
+def _resolve_fragments(tree, table):
+    if _is_reference(tree):
+        ref_id = tree[REFERENCE_KEY]
+        if ref_id not in table:
+            raise KeyError(f'reference "{ref_id}" not found in the reference table')
+        return _resolve_fragments(table[ref_id], table)
+
+    if not isinstance(tree, dict):
+        return copy.deepcopy(tree)
+
+    return {
+        key: _resolve_fragments(value, table)
+        for key, value in tree.items()}
+
+
+def expand_references(document):
+    """Inverse of `intern_references`: replace every `{'_ref': <id>}` with a copy
+    of its fragment. Documents without a reference table are returned unchanged."""
+    if REFERENCE_TABLE_KEY not in document:
+        return document
+
+    document = dict(document)
+    table = document.pop(REFERENCE_TABLE_KEY)
+    return _resolve_fragments(document, table)
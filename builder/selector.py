@@ -0,0 +1,313 @@
+"""
+Selector
+========
+
+Indexes over a builder's schema and tree for answering `Builder.select` queries
+without walking the whole tree by hand.
+"""
+
+import re
+import fnmatch
+from bigraph_schema.parse import parse_expression
+from bigraph_schema.registry import get_path
+
+
+def type_key(schema):
+    """Render a resolved schema back to a type expression such as 'map[float]'."""
+    if not isinstance(schema, dict) or '_type' not in schema:
+        return None
+
+    base = schema['_type']
+    parameters = schema.get('_type_parameters', [])
+    if not parameters:
+        return base
+
+    rendered = [
+        type_key(schema.get(f'_{parameter}')) or 'any'
+        for parameter in parameters]
+    return f"{base}[{','.join(rendered)}]"
+
+
+def normalize_type_expression(type_expression):
+    """Drop whitespace around brackets and commas, e.g. 'map[ float ]' -> 'map[float]'.
+    Whitespace inside a name such as 'default 1' is kept."""
+    return re.sub(r'\s*([\[\],])\s*', r'\1', type_expression).strip()
+
+
+def child_schema(schema, key):
+    """Schema of the branch under `key`, including the entries of a map."""
+    if not isinstance(schema, dict):
+        return {}
+    if key in schema:
+        return schema[key]
+    if schema.get('_type') == 'map':
+        return schema.get('_value', {})
+    return {}
+
+
+def resolve_wire(path, wire):
+    """Absolute path of a wire relative to the edge's parent path."""
+    resolved = list(path)
+    for key in wire:
+        if key == '..':
+            if resolved:
+                resolved.pop()
+        else:
+            resolved.append(key)
+    return tuple(resolved)
+
+
+def wire_targets(path, wires):
+    """Absolute target paths of every wire in a (possibly nested) wires dict."""
+    targets = []
+    for wire in (wires or {}).values():
+        if isinstance(wire, dict):
+            targets.extend(wire_targets(path, wire))
+        elif isinstance(wire, (list, tuple)):
+            targets.append(resolve_wire(path, wire))
+        elif isinstance(wire, str):
+            targets.append(resolve_wire(path, [wire]))
+    return targets
+
+
+def path_exists(tree, path):
+    for key in path:
+        if not isinstance(tree, dict) or key not in tree:
+            return False
+        tree = tree[key]
+    return True
+
+
+def match_path(pattern, path):
+    """Glob match a path against a pattern of keys, where '*' matches one
+    level, '**' matches any number of levels and other keys may use fnmatch
+    wildcards."""
+    if not pattern:
+        return not path
+
+    head, tail = pattern[0], pattern[1:]
+    if head == '**':
+        return any(
+            match_path(tail, path[index:])
+            for index in range(len(path) + 1))
+
+    if not path:
+        return False
+
+    return fnmatch.fnmatchcase(str(path[0]), str(head)) and match_path(tail, path[1:])
+
+
+def is_literal(key):
+    return not (isinstance(key, str) and any(char in key for char in '*?['))
+
+
+def is_config_value(value):
+    """Scalar config values are indexed, anything else is checked after lookup."""
+    return isinstance(value, (str, int, float, bool)) or value is None
+
+
+def is_edge_schema(schema):
+    """Edges (processes and steps) carry their port schemas alongside '_type'."""
+    return isinstance(schema, dict) and ('_inputs' in schema or '_outputs' in schema)
+
+
+def normalize_address(address):
+    """Accept either a full address or a bare registered process name."""
+    if ':' not in address:
+        address = f'local:{address}'
+    return address
+
+
+class SelectorIndex:
+    """Type and address indexes over every node path in a builder tree.
+
+    Each indexed path remembers which index entries it was added under, and its
+    children, so an edited subtree can be dropped and reindexed on its own.
+    Edited paths, and wire targets whose stores `complete` has not created
+    yet, wait in `pending` until the next `refresh`.
+    """
+
+    def __init__(self, core, schema, tree):
+        self.core = core
+        self.tree = tree
+        self.pending = set()
+        self.type_index = {}
+        self.addresses = {}
+        self.configs = {}
+        self.entries = {}
+        self.children = {(): set()}
+        self.index_node(schema, tree, ())
+
+    @property
+    def paths(self):
+        return self.entries.keys()
+
+    def add(self, table, key, path):
+        if key is not None:
+            table.setdefault(key, set()).add(path)
+            self.entries[path].append((table, key))
+
+    def index_node(self, schema, tree, path):
+        if path:
+            self.entries[path] = []
+            self.children.setdefault(path[:-1], set()).add(path)
+            self.children[path] = set()
+
+            key = type_key(schema)
+            self.add(self.type_index, key, path)
+            if isinstance(schema, dict):
+                # index the bare type as well, so 'map' finds every 'map[...]'
+                base = schema.get('_type')
+                if base != key:
+                    self.add(self.type_index, base, path)
+
+        if not isinstance(tree, dict):
+            return
+
+        if path and is_edge_schema(schema):
+            self.add(self.addresses, tree.get('address'), path)
+            targets = (
+                wire_targets(path[:-1], tree.get('inputs'))
+                + wire_targets(path[:-1], tree.get('outputs')))
+            self.pending.update(
+                target for target in targets
+                if not path_exists(self.tree, target))
+            for key, value in (tree.get('config') or {}).items():
+                if is_config_value(value):
+                    self.add(self.configs, (key, value), path)
+            return
+
+        for key, subtree in tree.items():
+            if isinstance(key, str) and key.startswith('_'):
+                continue
+            self.index_node(child_schema(schema, key), subtree, path + (key,))
+
+    def remove(self, path):
+        """Drop a path and everything below it from the indexes."""
+        for child in list(self.children.get(path, ())):
+            self.remove(child)
+
+        for table, key in self.entries.pop(path, []):
+            table[key].discard(path)
+            if not table[key]:
+                del table[key]
+
+        if path:
+            self.children.pop(path, None)
+            self.children.get(path[:-1], set()).discard(path)
+
+    def refresh(self, schema, tree):
+        """Reindex the pending paths, keeping those not in the tree yet."""
+        self.tree = tree
+        pending, self.pending = self.pending, set()
+        for path in pending:
+            if not self.reindex(schema, tree, path):
+                self.pending.add(path)
+
+    def reindex(self, schema, tree, path):
+        """Bring the indexes up to date for the subtree at `path` after an edit.
+        Returns False if the path is not in the tree (yet)."""
+        # start from the shallowest ancestor the index has not seen yet
+        path = tuple(path)
+        while len(path) > 1 and path[:-1] not in self.entries:
+            path = path[:-1]
+
+        self.remove(path)
+
+        for key in path:
+            if not isinstance(tree, dict) or key not in tree:
+                return False
+            schema = child_schema(schema, key)
+            tree = tree[key]
+
+        self.index_node(schema, tree, path)
+        return True
+
+    def walk(self, pattern, path=()):
+        """Paths matching `pattern`, following `children` so that literal keys
+        are looked up directly instead of scanning every indexed path."""
+        if not pattern:
+            return {path} if path else set()
+
+        head, tail = pattern[0], pattern[1:]
+        if head == '**':
+            found = self.walk(tail, path)
+            for child in self.children.get(path, ()):
+                found |= self.walk(pattern, child)
+            return found
+
+        if is_literal(head):
+            child = path + (head,)
+            return self.walk(tail, child) if child in self.entries else set()
+
+        found = set()
+        for child in self.children.get(path, ()):
+            if fnmatch.fnmatchcase(str(child[-1]), head):
+                found |= self.walk(tail, child)
+        return found
+
+    def lookup_type(self, type_expression):
+        type_expression = normalize_type_expression(type_expression)
+        if type_expression in self.type_index:
+            return self.type_index[type_expression]
+
+        # malformed expressions such as 'map[' match nothing
+        try:
+            parse_expression(type_expression)
+        except Exception:
+            return set()
+
+        # normalize the expression through the type registry,
+        # e.g. 'map[float]' and a registered alias of it resolve the same
+        resolved = type_key(self.core.access(type_expression))
+        return self.type_index.get(resolved, set())
+
+    def select(self, pattern=None, type=None, address=None, config=None, tree=None):
+        """
+        Intersect the index entries for `type`, `address` and the scalar values
+        in `config`, starting from the smallest. Non-scalar config values are
+        checked on the remaining candidates only.
+        """
+        if pattern is not None:
+            pattern = (pattern,) if isinstance(pattern, (str, int)) else tuple(pattern)
+
+        config = config or {}
+        candidates = []
+        if type is not None:
+            candidates.append(self.lookup_type(type))
+        if address is not None:
+            candidates.append(self.addresses.get(normalize_address(address), set()))
+        for key, value in config.items():
+            if is_config_value(value):
+                candidates.append(self.configs.get((key, value), set()))
+
+        unindexed = {
+            key: value
+            for key, value in config.items()
+            if not is_config_value(value)}
+        if unindexed and not candidates:
+            # only processes have a config
+            candidates.append(set().union(*self.addresses.values()))
+
+        if candidates:
+            candidates.sort(key=len)
+            paths = set(candidates[0]).intersection(*candidates[1:])
+            if pattern is not None:
+                paths = [path for path in paths if match_path(pattern, path)]
+        elif pattern is not None:
+            paths = self.walk(pattern)
+        else:
+            paths = list(self.paths)
+
+        if unindexed:
+            paths = [
+                path for path in paths
+                if config_matches(unindexed, get_path(tree, path).get('config', {}))]
+
+        return sorted(paths, key=lambda path: [str(key) for key in path])
+
+
+def config_matches(expected, config):
+    return all(
+        key in config and config[key] == value
+        for key, value in expected.items())